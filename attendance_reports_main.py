@@ -1,13 +1,19 @@
 # pip install msal requests
-import os, msal, requests
+import os, msal
+import io
 import sys
-import json
+import orjson
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
 from datetime import datetime, timedelta, timezone
-from azure.identity import DefaultAzureCredential
-from azure.storage.blob import BlobServiceClient, ContentSettings
-from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from azure.storage.blob import ContentSettings
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
 import config as cfg
-from parquet_utils import json_docs_to_dataframes, write_parquet_blob
+from azure_clients import HTTP_SESSION, UPLOAD_MAX_CONCURRENCY, get_service_client, ensure_container
+from parquet_utils import json_docs_to_tables, write_parquet_blob
 
 
 TENANT        = cfg.get_details("tenant")
@@ -29,35 +35,31 @@ REG_ACCOUNT_URL  = os.getenv("REG_ACCOUNT_URL",  "https://sgaanalyticsstorageacn
 REG_CONTAINER    = os.getenv("REG_CONTAINER",    "staging")
 REG_BLOB_NAME    = os.getenv("REG_BLOB_NAME",    "msteams/registry/latest_meeting_start.txt")
 
+# ===== Output (JSON snapshots + Parquet) location =====
+OUT_ACCOUNT_URL  = os.getenv("OUT_ACCOUNT_URL",  "https://sgaanalyticsstorageacnt.blob.core.windows.net")
+OUT_CONTAINER    = os.getenv("OUT_CONTAINER",    "staging")
+
+# Pretty-printed JSON snapshots are ~2x larger; only for debugging
+JSON_PRETTY      = os.getenv("JSON_PRETTY", "").lower() in ("1", "true", "yes")
+
 # ---------- Blob helpers ----------
 def _blob_client(account_url: str, container: str, blob_name: str):
-    cred = DefaultAzureCredential()
-    svc  = BlobServiceClient(account_url=account_url, credential=cred)
-    try:
-        svc.get_container_client(container).create_container()
-    except ResourceExistsError:
-        pass
-    return svc.get_blob_client(container=container, blob=blob_name)
+    ensure_container(account_url, container)
+    return get_service_client(account_url).get_blob_client(container=container, blob=blob_name)
 
 
 
 
 def save_json_to_blob(
     json_payload,
-    account_url="https://sgaanalyticsstorageacnt.blob.core.windows.net",
-    container="staging",
+    account_url=OUT_ACCOUNT_URL,
+    container=OUT_CONTAINER,
     app_prefix="msteams",
     blob_name=None,
     file_name="",
     overwrite=True,  # <— default to overwrite
+    pretty=None,     # None -> JSON_PRETTY env flag
 ) -> str:
-    cred = DefaultAzureCredential()
-    svc  = BlobServiceClient(account_url=account_url, credential=cred)
-    try:
-        svc.get_container_client(container).create_container()
-    except ResourceExistsError:
-        pass
-
     # Build deterministic path: yyyy/mm/dd/<file_name>.json
     if not blob_name:
         now = datetime.now(timezone.utc)
@@ -67,7 +69,12 @@ def save_json_to_blob(
 
     # Normalize to bytes
     if isinstance(json_payload, (dict, list)):
-        data = json.dumps(json_payload, ensure_ascii=False, indent=2).encode("utf-8")
+        opts = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+        if pretty is None:
+            pretty = JSON_PRETTY
+        if pretty:
+            opts |= orjson.OPT_INDENT_2
+        data = orjson.dumps(json_payload, option=opts)
     elif isinstance(json_payload, str):
         data = json_payload.encode("utf-8")
     elif isinstance(json_payload, bytes):
@@ -75,10 +82,14 @@ def save_json_to_blob(
     else:
         raise TypeError("json_payload must be dict, list, str, or bytes")
 
-    blob = svc.get_blob_client(container, blob_name)
+    blob = _blob_client(account_url, container, blob_name)
+    # Hand the SDK a stream over the encoded bytes: the block uploader reads each
+    # block straight from it instead of slicing copies off a bytes object.
     blob.upload_blob(
-        data=data,
+        data=io.BytesIO(data),
+        length=len(data),
         overwrite=overwrite,  # <— key bit
+        max_concurrency=UPLOAD_MAX_CONCURRENCY,
         content_settings=ContentSettings(content_type="application/json"),
     )
     return f"{account_url.rstrip('/')}/{container}/{blob_name}"
@@ -92,75 +103,109 @@ def to_iso_z(dt: datetime) -> str:
     return dt.replace(microsecond=0).isoformat().replace("+00:00", "Z")
 
 def parse_graph_datetime(dt_str: str) -> datetime | None:
-    if not dt_str:
-        return None
+    # Python 3.11+ fromisoformat takes the trailing "Z" and Graph's 7-digit fractions as-is
     try:
-        if dt_str.endswith("Z"):
-            dt_str = dt_str.replace("Z", "+00:00")
         dt = datetime.fromisoformat(dt_str)
-        if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=timezone.utc)
-        return dt.astimezone(timezone.utc)
-    except Exception:
+    except (TypeError, ValueError):
         return None
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)  # Graph returns event times in UTC unless asked otherwise
+    return dt.astimezone(timezone.utc)
+
+_REG_BLOB = get_service_client(REG_ACCOUNT_URL).get_blob_client(REG_CONTAINER, REG_BLOB_NAME)
+REG_SAVE_ATTEMPTS = 3
 
-def load_checkpoint_from_blob() -> datetime | None:
-    bc = _blob_client(REG_ACCOUNT_URL, REG_CONTAINER, REG_BLOB_NAME)
+def load_checkpoint_from_blob() -> tuple[datetime | None, str | None]:
+    # Returns (checkpoint, etag); the etag guards the later save against concurrent runs
     try:
-        data = bc.download_blob().readall().decode("utf-8").strip()
-        if not data:
-            return None
-        s = data.replace("Z", "+00:00") if data.endswith("Z") else data
-        dt = datetime.fromisoformat(s)
-        if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=timezone.utc)
-        return dt.astimezone(timezone.utc)
+        downloader = _REG_BLOB.download_blob()
+        data = downloader.readall().decode("utf-8").strip()
+        return parse_graph_datetime(data), downloader.properties.etag
     except ResourceNotFoundError:
-        return None
+        return None, None
     except Exception:
-        return None
-
-def save_checkpoint_to_blob(latest_dt: datetime) -> str:
-    bc = _blob_client(REG_ACCOUNT_URL, REG_CONTAINER, REG_BLOB_NAME)
-    content = latest_dt.encode("utf-8")
-    bc.upload_blob(
-        data=content,
-        overwrite=True,  # always replace registry
-        content_settings=ContentSettings(content_type="text/plain; charset=utf-8"),
-    )
+        return None, None
+
+def save_checkpoint_to_blob(latest_iso: str, etag: str | None = None) -> str:
+    # Conditional write: only replaces the registry version we loaded (or creates it
+    # if there was none). If another run got there first, keep whichever is newer.
+    for _ in range(REG_SAVE_ATTEMPTS):
+        if etag:
+            condition = {"etag": etag, "match_condition": MatchConditions.IfNotModified}
+        else:
+            condition = {"match_condition": MatchConditions.IfMissing}
+        try:
+            _REG_BLOB.upload_blob(
+                data=latest_iso.encode("utf-8"),
+                overwrite=True,
+                content_settings=ContentSettings(content_type="text/plain; charset=utf-8"),
+                **condition,
+            )
+            break
+        except (ResourceModifiedError, ResourceExistsError):
+            current, etag = load_checkpoint_from_blob()
+            latest = parse_graph_datetime(latest_iso)
+            if current and latest and current >= latest:
+                print("Registry already advanced by another run ->", to_iso_z(current))
+                break
+    else:
+        raise RuntimeError("Registry update kept conflicting with concurrent writers")
     return f"{REG_ACCOUNT_URL.rstrip('/')}/{REG_CONTAINER}/{REG_BLOB_NAME}"
 
 # ---------- Auth ----------
+# One MSAL app per (tenant, client) for the process: its in-memory token cache then
+# serves every later acquire_token_for_client call until the token nears expiry
+# (msal >= 1.23 checks the cache before calling AAD). Built lazily because the
+# constructor does authority discovery over the network.
+_MSAL_APPS: dict[tuple[str, str], msal.ConfidentialClientApplication] = {}
+
+def _msal_app(tenant: str, client_id: str, client_secret: str) -> msal.ConfidentialClientApplication:
+    app = _MSAL_APPS.get((tenant, client_id))
+    if app is None:
+        app = msal.ConfidentialClientApplication(
+            client_id,
+            authority=f"https://login.microsoftonline.com/{tenant}",
+            client_credential=client_secret,
+            http_client=HTTP_SESSION,
+        )
+        _MSAL_APPS[(tenant, client_id)] = app
+    return app
+
 def acquire_app_token(tenant: str, client_id: str, client_secret: str) -> str:
-    app = msal.ConfidentialClientApplication(
-        client_id,
-        authority=f"https://login.microsoftonline.com/{tenant}",
-        client_credential=client_secret
-    )
+    app = _msal_app(tenant, client_id, client_secret)
     result = app.acquire_token_for_client(scopes=["https://graph.microsoft.com/.default"])
     if "access_token" not in result:
         raise RuntimeError(f"Token acquisition failed: {result.get('error_description')}")
     return result["access_token"]
 
+# ---------- Graph concurrency ----------
+GRAPH_MAX_WORKERS = 16
+# Caps in-flight Graph requests across all worker threads (Graph throttles per app/tenant)
+_GRAPH_SLOTS = threading.Semaphore(GRAPH_MAX_WORKERS)
+
 # ---------- Graph paging ----------
 def graph_paged_get(start_url: str, headers: dict, params: dict | None = None):
     url = start_url
     first = True
     while url:
-        if first and params:
-            r = requests.get(url, headers=headers, params=params, timeout=60)
-            first = False
-        else:
-            r = requests.get(url, headers=headers, timeout=60)
+        with _GRAPH_SLOTS:
+            if first and params:
+                r = HTTP_SESSION.get(url, headers=headers, params=params, timeout=60)
+                first = False
+            else:
+                r = HTTP_SESSION.get(url, headers=headers, timeout=60)
         try:
             r.raise_for_status()
         except Exception:
             raise RuntimeError(f"Graph GET failed {r.status_code}: {r.text}")
-        payload = r.json()
+        # orjson parses the multi-MB attendance pages several times faster than stdlib json
+        payload = orjson.loads(r.content)
         yield payload
         url = payload.get("@odata.nextLink")
 
 # ---------- Fetch events ----------
+EVENTS_PAGE_SIZE = 999  # each page is a full round trip; Graph's default is 10
+
 def fetch_all_events(headers: dict, user_upn: str, use_calendar_view=False,
                      start_dt_iso=None, end_dt_iso=None) -> list:
     if use_calendar_view:
@@ -176,7 +221,7 @@ def fetch_all_events(headers: dict, user_upn: str, use_calendar_view=False,
         "start,end,location,isOnlineMeeting,onlineMeeting,onlineMeetingUrl,webLink"
     )
     orderby = "$orderby=start/dateTime"
-    top = "$top=50"
+    top = f"$top={EVENTS_PAGE_SIZE}"
 
     joiner = "&" if "?" in base else "?"
     url = f"{base}{joiner}{select}&{orderby}&{top}"
@@ -186,39 +231,173 @@ def fetch_all_events(headers: dict, user_upn: str, use_calendar_view=False,
         all_events.extend(page.get("value", []))
     return all_events
 
+# ---------- Graph batching ----------
+GRAPH_BATCH_URL  = "https://graph.microsoft.com/v1.0/$batch"
+GRAPH_BATCH_SIZE = 20  # hard limit of requests per $batch call
+# Only the id is used downstream; full onlineMeeting objects also carry joinInformation
+# (an HTML blob), participants, chatInfo, lobby settings, ...
+ONLINE_MEETING_SELECT = "id,joinWebUrl,subject"
+GRAPH_BATCH_RETRIES = 5
+# Throttling inside a $batch comes back per sub-request, not on the HTTP response,
+# so the adapter's Retry never sees it; those sub-requests are re-sent here.
+_BATCH_RETRY_STATUSES = (429, 503)
+
+def _post_batch(headers: dict, chunk: list) -> list:
+    with _GRAPH_SLOTS:
+        r = HTTP_SESSION.post(GRAPH_BATCH_URL, headers=headers, json={"requests": chunk}, timeout=60)
+    try:
+        r.raise_for_status()
+    except Exception:
+        raise RuntimeError(f"Graph batch failed {r.status_code}: {r.text}")
+    return orjson.loads(r.content).get("responses", [])
+
+def _batch_retry_delay(throttled: list, attempt: int) -> float:
+    waits = []
+    for resp in throttled:
+        try:
+            waits.append(float((resp.get("headers") or {}).get("Retry-After")))
+        except (TypeError, ValueError):
+            pass
+    return max(waits) if waits else 0.5 * (2 ** attempt)
+
+def graph_batch(headers: dict, requests_list: list) -> dict:
+    # requests_list: [{"id": "...", "method": "GET", "url": "/users/..."}], relative to /v1.0
+    # Returns {id: response} where response = {"id", "status", "headers", "body"}
+    # Chunks of 20 are posted concurrently; throttled sub-requests are retried
+    # after Retry-After (or exponential backoff) up to GRAPH_BATCH_RETRIES times.
+    responses = {}
+    pending = requests_list
+    for attempt in range(GRAPH_BATCH_RETRIES + 1):
+        chunks = [pending[i:i + GRAPH_BATCH_SIZE] for i in range(0, len(pending), GRAPH_BATCH_SIZE)]
+        with ThreadPoolExecutor(max_workers=GRAPH_MAX_WORKERS) as ex:
+            for chunk_responses in ex.map(lambda chunk: _post_batch(headers, chunk), chunks):
+                for resp in chunk_responses:
+                    responses[resp.get("id")] = resp
+
+        throttled = [responses[req["id"]] for req in pending
+                     if responses.get(req["id"], {}).get("status") in _BATCH_RETRY_STATUSES]
+        if not throttled or attempt == GRAPH_BATCH_RETRIES:
+            break
+        time.sleep(_batch_retry_delay(throttled, attempt))
+        retry_ids = {resp.get("id") for resp in throttled}
+        pending = [req for req in pending if req["id"] in retry_ids]
+    return responses
+
+def _batch_values(resp: dict, headers: dict) -> list:
+    # "value" of one batched response; any further pages are fetched via @odata.nextLink
+    status = resp.get("status", 0)
+    body = resp.get("body") or {}
+    if status >= 400:
+        raise RuntimeError(f"Graph GET failed {status}: {body}")
+    values = list(body.get("value", []))
+    next_link = body.get("@odata.nextLink")
+    if next_link:
+        for page in graph_paged_get(next_link, headers):
+            values.extend(page.get("value", []))
+    return values
+
+def _batch_values_all(responses: dict, count: int, headers: dict) -> list:
+    # _batch_values for ids "0".."count-1", concurrently (nextLink follow-ups are
+    # independent round trips). A failed id yields its exception instead of a list.
+    def one(i):
+        try:
+            return _batch_values(responses[str(i)], headers)
+        except Exception as ex:
+            return ex
+    with ThreadPoolExecutor(max_workers=GRAPH_MAX_WORKERS) as ex:
+        return list(ex.map(one, range(count)))
+
 # ---------- Online meeting + attendance ----------
-def find_online_meeting_by_join_url(headers: dict, user_upn: str, join_url: str) -> dict | None:
-    # No $top here (some tenants disallow it)
-    base = f"https://graph.microsoft.com/v1.0/users/{user_upn}/onlineMeetings"
-    params = {"$filter": f"JoinWebUrl eq '{join_url}'"}
-    for page in graph_paged_get(base, headers, params=params):
-        items = page.get("value", [])
-        if items:
-            return items[0]
-    return None
-
-def fetch_attendance_for_meeting(headers: dict, user_upn: str, meeting_id: str) -> list:
-    reports_url = f"https://graph.microsoft.com/v1.0/users/{user_upn}/onlineMeetings/{meeting_id}/attendanceReports"
-    all_reports = []
-    for page in graph_paged_get(reports_url, headers):
-        for rep in page.get("value", []):
-            rid = rep.get("id")
-            records_url = (f"https://graph.microsoft.com/v1.0/users/{user_upn}/"
-                           f"onlineMeetings/{meeting_id}/attendanceReports/{rid}/attendanceRecords")
-            all_records = []
-            for rpage in graph_paged_get(records_url, headers):
-                all_records.extend(rpage.get("value", []))
-            all_reports.append({
-                "report_id": rid,
-                "meetingStartDateTime": rep.get("meetingStartDateTime"),
-                "meetingEndDateTime": rep.get("meetingEndDateTime"),
-                "total_participants": rep.get("totalParticipantCount"),
-                "records": all_records
-            })
-    return all_reports
+# (upn, joinUrl) -> onlineMeeting (None = no meeting found) for the life of the run.
+# Failed lookups are not cached, so a transient error gets retried next time.
+_MEETING_BY_JOIN_URL: dict[tuple[str, str], dict | None] = {}
+
+def fetch_attendance_for_join_urls(headers: dict, user_upn: str, join_urls) -> dict:
+    """
+    Resolves onlineMeetings and their attendance reports/records for many join URLs
+    using Graph $batch (one round trip per 20 lookups instead of one per lookup).
+    Returns {join_url: {"meta": onlineMeeting | None, "attendance": payload | None}}.
+    """
+    base = f"/users/{user_upn}/onlineMeetings"
+    results = {}
+    joins = list(dict.fromkeys(join_urls))  # de-dupe, keep order
+
+    # 1) onlineMeeting lookup by join URL, cache misses only
+    #    (no $top here, some tenants disallow it)
+    misses = [join for join in joins if (user_upn, join) not in _MEETING_BY_JOIN_URL]
+    lookups = [
+        {"id": str(i), "method": "GET",
+         "url": f"{base}?" + urlencode({"$filter": f"JoinWebUrl eq '{join}'", "$select": ONLINE_MEETING_SELECT})}
+        for i, join in enumerate(misses)
+    ]
+    responses = graph_batch(headers, lookups)
+    for join, items in zip(misses, _batch_values_all(responses, len(misses), headers)):
+        if isinstance(items, Exception):
+            results[join] = {"meta": None, "attendance": {"error": f"attendance lookup failed: {items}"}}
+            continue
+        meta = items[0] if items else None
+        _MEETING_BY_JOIN_URL[(user_upn, join)] = meta if meta and meta.get("id") else None
+
+    meetings = []  # [(join, meeting_id)]
+    for join in joins:
+        if join in results:  # lookup failed above
+            continue
+        meta = _MEETING_BY_JOIN_URL[(user_upn, join)]
+        results[join] = {"meta": meta, "attendance": None}
+        if meta:
+            meetings.append((join, meta["id"]))
+
+    # 2) attendance reports per resolved meeting
+    # (attendanceReports/attendanceRecords take no OData query options, so no $select)
+    report_reqs = [
+        {"id": str(i), "method": "GET", "url": f"{base}/{mid}/attendanceReports"}
+        for i, (_, mid) in enumerate(meetings)
+    ]
+    responses = graph_batch(headers, report_reqs)
+    reports = []  # [(join, meeting_id, report)]
+    for (join, mid), reps in zip(meetings, _batch_values_all(responses, len(meetings), headers)):
+        if isinstance(reps, Exception):
+            results[join]["attendance"] = {"error": f"attendance lookup failed: {reps}"}
+            continue
+        reports.extend((join, mid, rep) for rep in reps)
+        results[join]["attendance"] = {"onlineMeetingId": mid, "attendanceReports": []}
+
+    # 3) attendance records per report
+    record_reqs = [
+        {"id": str(i), "method": "GET",
+         "url": f"{base}/{mid}/attendanceReports/{rep.get('id')}/attendanceRecords"}
+        for i, (_, mid, rep) in enumerate(reports)
+    ]
+    responses = graph_batch(headers, record_reqs)
+    for (join, mid, rep), records in zip(reports, _batch_values_all(responses, len(reports), headers)):
+        attendance = results[join]["attendance"]
+        if "error" in attendance:
+            continue
+        if isinstance(records, Exception):
+            results[join]["attendance"] = {"error": f"attendance lookup failed: {records}"}
+            continue
+        attendance["attendanceReports"].append({
+            "report_id": rep.get("id"),
+            "meetingStartDateTime": rep.get("meetingStartDateTime"),
+            "meetingEndDateTime": rep.get("meetingEndDateTime"),
+            "total_participants": rep.get("totalParticipantCount"),
+            "records": records
+        })
+    return results
+
+def _with_attendance(ev: dict, found: dict | None) -> dict:
+    # Copy of the event with onlineMeetingMeta/attendance embedded; the original stays
+    # untouched since it is also part of the events-only snapshot.
+    enriched = dict(ev)
+    found = found or {}
+    if found.get("meta"):
+        enriched["onlineMeetingMeta"] = found["meta"]
+    if found.get("attendance"):
+        enriched["attendance"] = found["attendance"]
+    return enriched
 
 # ---------- Main ----------
-def main(SGA_UPN,user_name):
+def main(SGA_UPN,user_name,last_seen=None):
     try:
         access_token = acquire_app_token(TENANT, CLIENT_ID, CLIENT_SECRET)
         headers = {"Authorization": f"Bearer {access_token}"}
@@ -226,9 +405,6 @@ def main(SGA_UPN,user_name):
         now_utc = datetime.now(timezone.utc)
         end_iso = to_iso_z(now_utc)
 
-        # Load checkpoint from Blob
-        last_seen = load_checkpoint_from_blob()
-
         # Decide window + fetch events
         if last_seen is None:
             start_utc = now_utc - timedelta(days=30)  # first run
@@ -253,47 +429,42 @@ def main(SGA_UPN,user_name):
             "count": len(events),
             "events": events,
         }
-        events_only_url = save_json_to_blob(
+        # JSON snapshots upload in the background while attendance is fetched and
+        # the Parquet tables are built; both are awaited before main returns.
+        json_uploads = ThreadPoolExecutor(max_workers=2)
+        events_only_upload = json_uploads.submit(
+            save_json_to_blob,
             events_only_payload,
             app_prefix="msteams/json/events-only",
             file_name=f"events_{user_name}",     # stable name -> overwrite in same folder/date
             overwrite=True
         )
-        print("Saved EVENTS-ONLY JSON to:", events_only_url)
 
         # ---- Enrich with attendance & track latest start ----
-        enriched_events = []
         latest_start_seen = last_seen or datetime.min.replace(tzinfo=timezone.utc)
+        online_joins = {}  # event index -> join URL
 
-        for ev in events:
+        for i, ev in enumerate(events):
             ev_start_dt = parse_graph_datetime((ev.get("start") or {}).get("dateTime"))
             if ev_start_dt and ev_start_dt > latest_start_seen:
                 latest_start_seen = ev_start_dt
 
             join    = (ev.get("onlineMeeting", {}) or {}).get("joinUrl") or ev.get("onlineMeetingUrl")
             online  = ev.get("isOnlineMeeting")
-
-            meeting_meta = None
-            attendance_payload = None
             if join and online:
-                try:
-                    meta = find_online_meeting_by_join_url(headers, SGA_UPN, join)
-                    if meta and meta.get("id"):
-                        meeting_meta = meta
-                        reports = fetch_attendance_for_meeting(headers, SGA_UPN, meta["id"])
-                        attendance_payload = {
-                            "onlineMeetingId": meta["id"],
-                            "attendanceReports": reports
-                        }
-                except Exception as ex:
-                    attendance_payload = {"error": f"attendance lookup failed: {ex}"}
-
-            enriched = dict(ev)
-            if meeting_meta:
-                enriched["onlineMeetingMeta"] = meeting_meta
-            if attendance_payload:
-                enriched["attendance"] = attendance_payload
-            enriched_events.append(enriched)
+                online_joins[i] = join
+
+        try:
+            attendance_by_join = fetch_attendance_for_join_urls(headers, SGA_UPN, online_joins.values())
+        except Exception as ex:
+            failed = {"meta": None, "attendance": {"error": f"attendance lookup failed: {ex}"}}
+            attendance_by_join = {join: failed for join in online_joins.values()}
+
+        # Events without a meeting lookup are reused as-is (nothing mutates them later)
+        enriched_events = [
+            _with_attendance(ev, attendance_by_join.get(online_joins[i])) if i in online_joins else ev
+            for i, ev in enumerate(events)
+        ]
 
         # ---- SAVE #2: final (events + attendance) — OVERWRITES within same date folder ----
         final_json = {
@@ -304,26 +475,27 @@ def main(SGA_UPN,user_name):
             "count": len(enriched_events),
             "events": enriched_events,
         }
-        final_url = save_json_to_blob(
+        final_upload = json_uploads.submit(
+            save_json_to_blob,
             final_json,
             app_prefix="msteams/json/final-with-attendance",
             file_name=f"event_attendance_details_{user_name}",  # stable name -> overwrite in same folder/date
             overwrite=True
         )
-        print("Saved FINAL (events+attendance) JSON to:", final_url)
-
-        
+        json_uploads.shutdown(wait=False)
 
         docs = [events_only_payload, final_json]  # one or many
-        dfs = json_docs_to_dataframes(docs,user_name)
+        tables = json_docs_to_tables(docs,user_name)
 
         # Write to blob
         urls = write_parquet_blob(
-            dfs,
-            account_url="https://sgaanalyticsstorageacnt.blob.core.windows.net",
-            container="staging",
+            tables,
+            account_url=OUT_ACCOUNT_URL,
+            container=OUT_CONTAINER,
             overwrite=True
         )
+        print("Saved EVENTS-ONLY JSON to:", events_only_upload.result())
+        print("Saved FINAL (events+attendance) JSON to:", final_upload.result())
         print("Parquet written at:", urls)
 
         return end_iso
@@ -337,12 +509,18 @@ def main(SGA_UPN,user_name):
         sys.exit(1)
 
 if __name__ == "__main__":
+    # Containers are created (if needed) once, up front; later writes skip the probe
+    ensure_container(REG_ACCOUNT_URL, REG_CONTAINER)
+    ensure_container(OUT_ACCOUNT_URL, OUT_CONTAINER)
+
+    # Load checkpoint from Blob once; every user shares the same window start
+    last_seen, reg_etag = load_checkpoint_from_blob()
     end_iso = None
     for user_name,SGA_UPN  in users.items():
-        end_iso = main(SGA_UPN,user_name)
-    # ---- Update registry in Blob (always overwrite) ----
+        end_iso = main(SGA_UPN,user_name,last_seen)
+    # ---- Update registry in Blob (conditional on the version loaded above) ----
     if end_iso:
-        reg_url = save_checkpoint_to_blob(end_iso)
+        reg_url = save_checkpoint_to_blob(end_iso, reg_etag)
         print("Updated registry blob:", reg_url, "->",end_iso)
     else:
         print("No valid meeting start times found to update registry.")
@@ -0,0 +1,182 @@
+# azure_clients.py
+from __future__ import annotations
+import base64
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Set, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from azure.core.pipeline.transport import RequestsTransport
+from azure.identity import DefaultAzureCredential
+from azure.storage.blob import BlobClient, BlobServiceClient, ContentSettings
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError
+
+# ---------- Shared HTTP pool ----------
+# One keep-alive pool for Graph calls and blob uploads, so TLS/TCP handshakes are
+# paid once per host instead of once per request.
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=32))
+# Graph gets its own, larger pool (longest mount prefix wins): every event costs
+# several Graph round trips, so it sees far more traffic than Blob.
+# Throttling/transient 5xx are retried here, honoring Retry-After. POST is included
+# because the only POST we send is the read-only $batch. Blob keeps the plain
+# adapter: the Azure SDK pipeline already has its own retry policy.
+_GRAPH_RETRY = Retry(
+    total=5,
+    backoff_factor=0.5,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=frozenset({"GET", "POST"}),
+    respect_retry_after_header=True,
+    raise_on_status=False,  # hand the last response back so callers report the Graph error body
+)
+HTTP_SESSION.mount(
+    "https://graph.microsoft.com/",
+    HTTPAdapter(pool_connections=20, pool_maxsize=40, max_retries=_GRAPH_RETRY),
+)
+_TRANSPORT = RequestsTransport(session=HTTP_SESSION, session_owner=False)
+
+# ---------- Upload tuning ----------
+# Payloads above max_single_put_size go up as parallel staged blocks. The SDK
+# default (64 MiB) would send every JSON/Parquet file here as one serial PUT.
+UPLOAD_MAX_CONCURRENCY = 8
+UPLOAD_BLOCK_SIZE      = 4 * 1024 * 1024
+
+# ---------- Shared clients ----------
+# One credential chain and one BlobServiceClient per account for the whole process.
+# Container/blob clients derived from the service share its pipeline + connection pool.
+_CRED = DefaultAzureCredential()
+_SVC_CACHE: Dict[str, BlobServiceClient] = {}
+_containers_ensured: Set[Tuple[str, str]] = set()
+
+def get_service_client(account_url: str) -> BlobServiceClient:
+    svc = _SVC_CACHE.get(account_url)
+    if svc is None:
+        svc = BlobServiceClient(
+            account_url=account_url,
+            credential=_CRED,
+            transport=_TRANSPORT,
+            max_single_put_size=UPLOAD_BLOCK_SIZE,
+            max_block_size=UPLOAD_BLOCK_SIZE,
+        )
+        _SVC_CACHE[account_url] = svc
+    return svc
+
+def ensure_container(account_url: str, container: str) -> None:
+    # create_container is a round trip; only do it once per container per run
+    key = (account_url, container)
+    if key in _containers_ensured:
+        return
+    try:
+        get_service_client(account_url).get_container_client(container).create_container()
+    except ResourceExistsError:
+        pass
+    _containers_ensured.add(key)
+
+# ---------- Streaming writes ----------
+class BlockBlobWriter:
+    """
+    Write-only file object that streams into a block blob, so a writer such as
+    pq.write_table never needs the whole file in memory. Each full block is staged as
+    soon as it fills (at most UPLOAD_MAX_CONCURRENCY in flight) and the block list is
+    committed on close. Content smaller than one block goes up as a single Put Blob.
+    As a context manager nothing is committed when the body raises, so a failed write
+    leaves the existing blob in place; staged blocks are discarded by the service.
+    """
+
+    def __init__(
+        self,
+        blob: BlobClient,
+        overwrite: bool = True,
+        content_settings: ContentSettings | None = None,
+        block_size: int = UPLOAD_BLOCK_SIZE,
+    ):
+        self._blob = blob
+        self._overwrite = overwrite
+        self._content_settings = content_settings
+        self._block_size = block_size
+        self._buf = bytearray()
+        self._block_ids: list = []
+        self._in_flight: deque = deque()
+        self._pool: ThreadPoolExecutor | None = None
+        self._size = 0
+        self.closed = False
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._size
+
+    def flush(self) -> None:
+        pass
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError("write to closed BlockBlobWriter")
+        self._buf += data
+        n = len(data)
+        self._size += n
+        while len(self._buf) >= self._block_size:
+            self._stage(bytes(self._buf[:self._block_size]))
+            del self._buf[:self._block_size]
+        return n
+
+    def _stage(self, block: bytes) -> None:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=UPLOAD_MAX_CONCURRENCY)
+        # Block ids must all have the same length; the index keeps them ordered
+        block_id = base64.b64encode(f"{len(self._block_ids):08d}".encode()).decode()
+        self._block_ids.append(block_id)
+        self._in_flight.append(self._pool.submit(self._blob.stage_block, block_id, block, length=len(block)))
+        if len(self._in_flight) >= UPLOAD_MAX_CONCURRENCY:
+            self._in_flight.popleft().result()  # bounds the memory held by pending blocks
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if not self._block_ids:
+                data = bytes(self._buf)
+                self._blob.upload_blob(
+                    data,
+                    length=len(data),
+                    overwrite=self._overwrite,
+                    content_settings=self._content_settings,
+                )
+                return
+            if self._buf:
+                self._stage(bytes(self._buf))
+            while self._in_flight:
+                self._in_flight.popleft().result()
+            condition = {} if self._overwrite else {"match_condition": MatchConditions.IfMissing}
+            self._blob.commit_block_list(
+                self._block_ids, content_settings=self._content_settings, **condition,
+            )
+        finally:
+            self._release()
+
+    def abort(self) -> None:
+        # Drop the buffered data without committing anything
+        self.closed = True
+        for fut in self._in_flight:
+            fut.cancel()
+        self._in_flight.clear()
+        self._release()
+
+    def _release(self) -> None:
+        self._buf = bytearray()
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def __enter__(self) -> "BlockBlobWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
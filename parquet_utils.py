@@ -1,181 +1,482 @@
 # parquet_utils.py
 from __future__ import annotations
-import io
 import json
-from typing import Any, Dict, Iterable, List, Tuple
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, BinaryIO, Dict, Iterable, List, Tuple
 import pandas as pd
-from azure.identity import DefaultAzureCredential
-from azure.storage.blob import BlobServiceClient, ContentSettings
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.json as pj
+import pyarrow.parquet as pq
+from azure.storage.blob import ContentSettings
+from azure_clients import BlockBlobWriter, get_service_client, ensure_container
 from datetime import datetime, timedelta, timezone
+from itertools import islice
 
-# ---------- Flatten helpers ----------
-def _get(d: Dict, path: str, default=None):
-    cur = d
-    for part in path.split("."):
-        if not isinstance(cur, dict) or part not in cur:
-            return default
-        cur = cur[part]
-    return cur
+# Snappy by default: the Synapse external file formats over these files may only accept
+# Snappy/GZIP. PARQUET_COMPRESSION=zstd roughly halves the bytes uploaded, for readers
+# that support it.
+PARQUET_COMPRESSION = os.getenv("PARQUET_COMPRESSION", "snappy")
+ZSTD_LEVEL          = 3        # with zstd: ~5% smaller than Arrow's default level 1 for a few % more CPU
+PARQUET_ROW_GROUP   = 100_000  # rows per row group, so large record files split for parallel reads
+DOCS_PER_BATCH      = 8        # docs flattened at a time by write_docs_parquet_blob
+# (Nearly) one distinct value per row: a dictionary page only adds size here
+PLAIN_ENCODED_COLUMNS = frozenset({"record_id", "event_id", "event_webLink"})
+# Keep the parsed types (TIMESTAMP, BOOLEAN, INT64) in the files instead of writing every
+# column as a string. Off by default: the Synapse external tables over these files
+# declare string columns, so switch this on together with their DDL.
+PARQUET_TYPED_COLUMNS = os.getenv("PARQUET_TYPED_COLUMNS", "").lower() in ("1", "true", "yes")
+# Folder layout under <app_prefix>/parquet/<table>/:
+#   "date" -> YYYY/MM/DD/            (default; what the Synapse pipelines point at)
+#   "hive" -> elt_date=YYYY-MM-DD/   (partition discovery/pruning in Spark, DuckDB, Polars, ...)
+PARQUET_PARTITIONING = os.getenv("PARQUET_PARTITIONING", "date").lower()
 
+# ---------- Arrow types for the exporter's JSON ----------
+# Only the fields that land in the Parquet tables are declared; pa.array skips every
+# other key (attendees, body, joinInformation, ...) without converting it.
+_STR, _INT = pa.string(), pa.int64()
+
+_INTERVAL_TYPE = pa.struct([
+    ("joinDateTime", _STR), ("leaveDateTime", _STR), ("durationInSeconds", _INT),
+])
+_RECORD_TYPE = pa.struct([
+    ("id", _STR),
+    ("identity", pa.struct([("displayName", _STR), ("tenantId", _STR)])),
+    ("emailAddress", _STR),
+    ("role", _STR),
+    ("attendanceIntervals", pa.list_(_INTERVAL_TYPE)),
+    ("externalRegistrationInformation", pa.struct([("referrer", _STR), ("registrationId", _STR)])),
+])
+_REPORT_TYPE = pa.struct([
+    ("report_id", _STR),
+    ("meetingStartDateTime", _STR),
+    ("meetingEndDateTime", _STR),
+    ("total_participants", _INT),
+    ("records", pa.list_(_RECORD_TYPE)),
+])
+_EVENT_TYPE = pa.struct([
+    ("id", _STR),
+    ("subject", _STR),
+    ("start", pa.struct([("dateTime", _STR), ("timeZone", _STR)])),
+    ("end", pa.struct([("dateTime", _STR), ("timeZone", _STR)])),
+    ("isOnlineMeeting", pa.bool_()),
+    ("onlineMeetingUrl", _STR),
+    ("onlineMeeting", pa.struct([("joinUrl", _STR)])),
+    ("webLink", _STR),
+    ("location", pa.struct([("displayName", _STR)])),
+    ("onlineMeetingMeta", pa.struct([("id", _STR)])),
+    ("attendance", pa.struct([
+        ("onlineMeetingId", _STR),
+        ("attendanceReports", pa.list_(_REPORT_TYPE)),
+    ])),
+])
+DOC_TYPE = pa.struct([
+    ("user", _STR),
+    ("windowStartUtc", _STR),
+    ("windowEndUtc", _STR),
+    ("fetchedUtc", _STR),
+    ("events", pa.list_(_EVENT_TYPE)),
+])
+
+# Output columns, in file order: (column, source level, field path within that level)
+EVENT_COLUMNS = (
+    ("doc_user",                    "doc",   ("user",)),
+    ("doc_windowStartUtc",          "doc",   ("windowStartUtc",)),
+    ("doc_windowEndUtc",            "doc",   ("windowEndUtc",)),
+    ("doc_fetchedUtc",              "doc",   ("fetchedUtc",)),
+    ("event_id",                    "event", ("id",)),
+    ("event_subject",               "event", ("subject",)),
+    ("event_start",                 "event", ("start", "dateTime")),
+    ("event_start_tz",              "event", ("start", "timeZone")),
+    ("event_end",                   "event", ("end", "dateTime")),
+    ("event_end_tz",                "event", ("end", "timeZone")),
+    ("event_isOnlineMeeting",       "event", ("isOnlineMeeting",)),
+    ("event_onlineMeetingUrl",      "event", ("onlineMeetingUrl",)),
+    ("event_onlineMeeting_joinUrl", "event", ("onlineMeeting", "joinUrl")),
+    ("event_webLink",               "event", ("webLink",)),
+    ("event_location_displayName",  "event", ("location", "displayName")),
+    ("onlineMeetingMeta_id",        "event", ("onlineMeetingMeta", "id")),
+)
+REPORT_COLUMNS = (
+    ("doc_user",             "doc",    ("user",)),
+    ("doc_fetchedUtc",       "doc",    ("fetchedUtc",)),
+    ("onlineMeetingId",      "event",  ("attendance", "onlineMeetingId")),
+    ("report_id",            "report", ("report_id",)),
+    ("meetingStartDateTime", "report", ("meetingStartDateTime",)),
+    ("meetingEndDateTime",   "report", ("meetingEndDateTime",)),
+    ("total_participants",   "report", ("total_participants",)),
+)
+# One row per attendance interval
+RECORD_COLUMNS = (
+    ("doc_user",          "doc",      ("user",)),
+    ("doc_fetchedUtc",    "doc",      ("fetchedUtc",)),
+    ("onlineMeetingId",   "event",    ("attendance", "onlineMeetingId")),
+    ("report_id",         "report",   ("report_id",)),
+    ("record_id",         "record",   ("id",)),
+    ("displayName",       "record",   ("identity", "displayName")),
+    ("tenantId",          "record",   ("identity", "tenantId")),
+    ("emailAddress",      "record",   ("emailAddress",)),
+    ("role",              "record",   ("role",)),
+    ("joinDateTime",      "interval", ("joinDateTime",)),
+    ("leaveDateTime",     "interval", ("leaveDateTime",)),
+    ("durationInSeconds", "interval", ("durationInSeconds",)),
+    ("externalRegistrationInformation_referrer",       "record", ("externalRegistrationInformation", "referrer")),
+    ("externalRegistrationInformation_registrationId", "record", ("externalRegistrationInformation", "registrationId")),
+)
+
+# ---------- Flatten (Arrow, columnar) ----------
+def _children(parent: pa.Array, path: Tuple[str, ...]) -> Tuple[pa.Array, pa.Array]:
+    # Flattened list elements at `path`, plus the parent row of each element
+    lists = pc.struct_field(parent, list(path))
+    return pc.list_flatten(lists), pc.list_parent_indices(lists)
+
+def _build_table(columns, levels: Dict[str, Tuple[pa.Array, pa.Array | None]]) -> pa.Table:
+    # levels: {level: (struct array, index into it per output row, or None if 1:1)}
+    arrays = []
+    for _, level, path in columns:
+        arr, rows = levels[level]
+        col = pc.struct_field(arr, list(path))
+        arrays.append(col if rows is None else col.take(rows))
+    return pa.table(arrays, names=[name for name, _, _ in columns])
+
+def docs_to_tables(docs: Iterable[Dict[str, Any]]) -> Tuple[pa.Table, pa.Table, pa.Table]:
+    """
+    Converts the exporter's JSON docs into (events, attendance reports, attendance
+    records) tables. The docs are read into one nested Arrow array in a single C++
+    pass; each child level is then a list_flatten, and parent columns are broadcast
+    to child rows with take() on the parent indices instead of per-row Python dicts.
+    """
+    return _flatten_doc_array(pa.array(list(docs), type=DOC_TYPE))
+
+def _flatten_doc_array(doc_arr: pa.StructArray) -> Tuple[pa.Table, pa.Table, pa.Table]:
+    events, ev_doc = _children(doc_arr, ("events",))
+    reports, rep_ev = _children(events, ("attendance", "attendanceReports"))
+    records, rec_rep = _children(reports, ("records",))
+    intervals, itv_rec = _children(records, ("attendanceIntervals",))
+
+    rep_doc = ev_doc.take(rep_ev)
+    itv_rep = rec_rep.take(itv_rec)
+    itv_ev = rep_ev.take(itv_rep)
+    itv_doc = ev_doc.take(itv_ev)
+
+    return (
+        _build_table(EVENT_COLUMNS, {"doc": (doc_arr, ev_doc), "event": (events, None)}),
+        _build_table(REPORT_COLUMNS, {"doc": (doc_arr, rep_doc), "event": (events, rep_ev),
+                                      "report": (reports, None)}),
+        _build_table(RECORD_COLUMNS, {"doc": (doc_arr, itv_doc), "event": (events, itv_ev),
+                                      "report": (reports, itv_rep), "record": (records, itv_rec),
+                                      "interval": (intervals, None)}),
+    )
+
+# Row-oriented views over docs_to_tables
 def flatten_events(doc: Dict[str, Any]) -> List[Dict[str, Any]]:
-    rows = []
-    for ev in doc.get("events", []) or []:
-        rows.append({
-            "doc_user": doc.get("user"),
-            "doc_windowStartUtc": doc.get("windowStartUtc"),
-            "doc_windowEndUtc": doc.get("windowEndUtc"),
-            "doc_fetchedUtc": doc.get("fetchedUtc"),
-            "event_id": ev.get("id"),
-            "event_subject": ev.get("subject"),
-            "event_start": _get(ev, "start.dateTime"),
-            "event_start_tz": _get(ev, "start.timeZone"),
-            "event_end": _get(ev, "end.dateTime"),
-            "event_end_tz": _get(ev, "end.timeZone"),
-            "event_isOnlineMeeting": ev.get("isOnlineMeeting"),
-            "event_onlineMeetingUrl": ev.get("onlineMeetingUrl"),
-            "event_onlineMeeting_joinUrl": _get(ev, "onlineMeeting.joinUrl"),
-            "event_webLink": ev.get("webLink"),
-            "event_location_displayName": _get(ev, "location.displayName"),
-            "onlineMeetingMeta_id": _get(ev, "onlineMeetingMeta.id"),
-        })
-    return rows
+    return docs_to_tables([doc])[0].to_pylist()
 
 def flatten_attendance_reports(doc: Dict[str, Any]) -> List[Dict[str, Any]]:
-    rows = []
-    for ev in doc.get("events", []) or []:
-        att = ev.get("attendance") or {}
-        for rep in att.get("attendanceReports", []) or []:
-            rows.append({
-                "doc_user": doc.get("user"),
-                "doc_fetchedUtc": doc.get("fetchedUtc"),
-                # "event_id": ev.get("id"),
-                # "event_subject": ev.get("subject"),
-                # "event_start": _get(ev, "start.dateTime"),
-                # "event_end": _get(ev, "end.dateTime"),
-                "onlineMeetingId": att.get("onlineMeetingId"),
-                "report_id": rep.get("report_id"),
-                "meetingStartDateTime": rep.get("meetingStartDateTime"),
-                "meetingEndDateTime": rep.get("meetingEndDateTime"),
-                "total_participants": rep.get("total_participants"),
-            })
-    return rows
+    return docs_to_tables([doc])[1].to_pylist()
 
 def flatten_attendance_records(doc: Dict[str, Any]) -> List[Dict[str, Any]]:
-    rows = []
-    for ev in doc.get("events", []) or []:
-        att = ev.get("attendance") or {}
-        for rep in att.get("attendanceReports", []) or []:
-            for rec in rep.get("records", []) or []:
-                for r in rec.get("attendanceIntervals",[]) or []:
-                    rows.append({
-                        "doc_user": doc.get("user"),
-                        "doc_fetchedUtc": doc.get("fetchedUtc"),
-                        # "event_id": ev.get("id"),
-                        # "event_subject": ev.get("subject"),
-                        # "event_start": _get(ev, "start.dateTime"),
-                        # "event_end": _get(ev, "end.dateTime"),
-                        "onlineMeetingId": att.get("onlineMeetingId"),
-                        "report_id": rep.get("report_id"),
-                        # "meetingStartDateTime": rep.get("meetingStartDateTime"),
-                        # "meetingEndDateTime": rep.get("meetingEndDateTime"),
-                        # "total_participants": rep.get("total_participants"),
-                        "record_id": rec.get("id"),
-                        "displayName": rec.get("identity").get("displayName"),
-                        "tenantId":rec.get("identity").get("tenantId"),
-                        "emailAddress": rec.get("emailAddress"),
-                        "role": rec.get("role"),
-                        "joinDateTime": r.get("joinDateTime"),
-                        "leaveDateTime": r.get("leaveDateTime"),
-                        "durationInSeconds": r.get("durationInSeconds"),
-                        "externalRegistrationInformation_referrer":rec.get("externalRegistrationInformation").get("referrer"),
-                        "externalRegistrationInformation_registrationId":rec.get("externalRegistrationInformation").get("registrationId"),
-
-                    })
-
-    return rows
-
-# ---------- Public API: JSON -> DataFrames ----------
-def json_docs_to_dataframes(docs: Iterable[Dict[str, Any]],user_name) -> Dict[str, pd.DataFrame]:
+    return docs_to_tables([doc])[2].to_pylist()
+
+# ---------- Public API: JSON -> Arrow tables / DataFrames ----------
+# Parsed to UTC timestamps (optional but handy)
+TIMESTAMP_COLUMNS = (
+    "doc_fetchedUtc", "event_start", "event_end",
+    "meetingStartDateTime", "meetingEndDateTime",
+    "joinDateTime", "leaveDateTime",
+)
+
+def _drop_all_null_rows(table: pa.Table) -> pa.Table:
+    # Arrow equivalent of DataFrame.dropna(how="all"). A column without nulls (doc_user
+    # in practice) rules out all-null rows from metadata alone, so the scan is skipped.
+    if not table.num_columns or not table.num_rows:
+        return table
+    if any(col.null_count == 0 for col in table.columns):
+        return table
+    keep = pc.is_valid(table.column(0))
+    for col in table.columns[1:]:
+        keep = pc.or_(keep, pc.is_valid(col))
+    return table if pc.all(keep).as_py() else table.filter(keep)
+
+def _parse_timestamps(table: pa.Table) -> pa.Table:
+    # One pd.to_datetime per column on pandas' C ISO 8601 parser. Without an explicit
+    # format pandas guesses one from the first value and coerces every value that
+    # doesn't match it (e.g. "...:30Z" after "...:00.123Z") to NaT.
+    # Arrow's own string->timestamp cast is not used: at ns it silently wraps Graph's
+    # "0001-01-01T00:00:00Z" placeholders instead of rejecting them.
+    for name in TIMESTAMP_COLUMNS:
+        i = table.schema.get_field_index(name)
+        if i >= 0:
+            ts = pd.to_datetime(table.column(i).to_pandas(), errors="coerce", utc=True,
+                                format="ISO8601", cache=True)
+            table = table.set_column(i, name, pa.array(ts))
+    return table
+
+# Schema metadata key naming the table kind (a FILE_SCHEMAS key). It travels with the
+# table so write_parquet_blob never has to re-parse it out of "<kind>_<user>".
+_TABLE_KIND_KEY = b"table_kind"
+
+def _output_tables(tables: Tuple[pa.Table, pa.Table, pa.Table], user_name) -> Dict[str, pa.Table]:
+    out = {}
+    for kind, t in zip(("events", "attendance_reports", "attendance_details_records"), tables):
+        t = _parse_timestamps(_drop_all_null_rows(t))
+        out[f"{kind}_{user_name}"] = t.replace_schema_metadata({_TABLE_KIND_KEY: kind.encode()})
+    return out
+
+def json_docs_to_tables(docs: Iterable[Dict[str, Any]], user_name) -> Dict[str, pa.Table]:
     """
     Accepts an iterable of JSON documents (dicts) produced by your exporter.
-    Returns dict of DataFrames: {'events': df, 'attendance_reports': df, 'attendance_records': df}
+    Returns dict of Arrow tables keyed by output file name:
+    {'events_<user>': t, 'attendance_reports_<user>': t, 'attendance_details_records_<user>': t}
+    """
+    return _output_tables(docs_to_tables(docs), user_name)
+
+def json_file_to_tables(source: str | os.PathLike | bytes | BinaryIO, user_name) -> Dict[str, pa.Table]:
+    """
+    Same output as json_docs_to_tables, for docs that are already serialized (e.g. the
+    JSON snapshots in Blob): a path, bytes or a binary stream holding one doc, or several
+    one after another (JSON Lines). Arrow's C++ reader parses straight into DOC_TYPE,
+    so no Python dicts are built at all.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            data = f.read()
+    elif isinstance(source, (bytes, bytearray)):
+        data = source
+    else:
+        data = source.read()
+
+    if not data or data.isspace():
+        doc_arr = pa.array([], type=DOC_TYPE)
+    else:
+        # One block for the whole input: a single doc (one user's export) is routinely
+        # larger than the reader's default block, and an object may not straddle blocks.
+        table = pj.read_json(
+            pa.BufferReader(data),
+            read_options=pj.ReadOptions(block_size=len(data)),
+            parse_options=pj.ParseOptions(
+                explicit_schema=pa.schema(list(DOC_TYPE)),
+                unexpected_field_behavior="ignore",
+            ),
+        )
+        doc_arr = pa.StructArray.from_arrays(
+            [col.combine_chunks() for col in table.columns], fields=list(DOC_TYPE),
+        )
+    return _output_tables(_flatten_doc_array(doc_arr), user_name)
+
+def json_docs_to_dataframes(docs: Iterable[Dict[str, Any]],user_name) -> Dict[str, pd.DataFrame]:
+    """
+    DataFrame view of json_docs_to_tables, for ad-hoc use. The job itself stays in Arrow.
     """
-    events_rows, reports_rows, records_rows = [], [], []
-    for doc in docs:
-        events_rows.extend(flatten_events(doc))
-        reports_rows.extend(flatten_attendance_reports(doc))
-        records_rows.extend(flatten_attendance_records(doc))
-
-    df_events   = pd.DataFrame(events_rows or [{}]).dropna(how="all")
-    df_reports  = pd.DataFrame(reports_rows or [{}]).dropna(how="all")
-    df_records  = pd.DataFrame(records_rows or [{}]).dropna(how="all")
-
-    # Normalize timestamps (optional but handy)
-    for col in [
-        "doc_fetchedUtc", "event_start", "event_end",
-        "meetingStartDateTime", "meetingEndDateTime",
-        "joinDateTime", "leaveDateTime"
-    ]:
-        for df in (df_events, df_reports, df_records):
-            if col in df.columns:
-                df[col] = pd.to_datetime(df[col], errors="coerce", utc=True)
-
-    return {
-        f"events_{user_name}": df_events,
-        f"attendance_reports_{user_name}": df_reports,
-        f"attendance_details_records_{user_name}": df_records
-    }
+    return {name: t.to_pandas() for name, t in json_docs_to_tables(docs, user_name).items()}
 
+# ---------- Parquet output ----------
+# The Synapse external tables read every column (elt_date included) as a string, so
+# values are rendered to text exactly as the former pandas astype("string") did.
+def _timestamp_text(col: pa.ChunkedArray) -> pa.ChunkedArray:
+    # "YYYY-MM-DD HH:MM:SS[.ffffff[fff]]+00:00", per value like pandas' Timestamp str:
+    # no fraction for whole seconds, 9 digits only when there are sub-us digits.
+    # Rendered from a naive (UTC wall clock) timestamp: Arrow formats those without the
+    # per-value time zone lookup that strftime/tz-aware casts pay.
+    unit = "ns" if col.type.unit == "ns" else "us"
+    text = col.cast(pa.timestamp(unit)).cast(pa.string())
+    text = pc.replace_substring_regex(text, r"\.0{6}(?:000)?$", "")
+    text = pc.replace_substring_regex(text, r"(\.\d{6})000$", r"\1")
+    return pc.binary_join_element_wise(text, "+00:00", "")
 
+# File schemas, keyed by output folder. Leaf types come from DOC_TYPE, timestamps are
+# fixed at TIMESTAMP(MICROS, UTC): pandas picks s/us/ns per batch, and not every reader
+# (Synapse included) handles TIMESTAMP(NANOS).
+_LEVEL_TYPES = {
+    "doc": DOC_TYPE, "event": _EVENT_TYPE, "report": _REPORT_TYPE,
+    "record": _RECORD_TYPE, "interval": _INTERVAL_TYPE,
+}
+
+def _file_schema(columns) -> pa.Schema:
+    fields = []
+    for name, level, path in columns:
+        if name in TIMESTAMP_COLUMNS:
+            typ = pa.timestamp("us", tz="UTC")
+        else:
+            typ = _LEVEL_TYPES[level]
+            for key in path:
+                typ = typ.field(key).type
+        fields.append(pa.field(name, typ))
+    return pa.schema(fields + [pa.field("elt_date", pa.string())])
+
+EVENTS_SCHEMA  = _file_schema(EVENT_COLUMNS)
+REPORTS_SCHEMA = _file_schema(REPORT_COLUMNS)
+RECORDS_SCHEMA = _file_schema(RECORD_COLUMNS)
+FILE_SCHEMAS = {
+    "events": EVENTS_SCHEMA,
+    "attendance_reports": REPORTS_SCHEMA,
+    "attendance_details_records": RECORDS_SCHEMA,
+}
+
+def _as_text(col: pa.ChunkedArray) -> pa.ChunkedArray:
+    t = col.type
+    if pa.types.is_string(t) or pa.types.is_large_string(t):
+        return col
+    if pa.types.is_boolean(t):
+        return pc.if_else(col, "True", "False")
+    if pa.types.is_timestamp(t):
+        return _timestamp_text(col)
+    return col.cast(pa.string())
+
+_PARQUET_CONTENT = ContentSettings(content_type="application/octet-stream")
+
+def _write_settings(typed: bool | None, partitioning: str | None) -> Tuple[bool, str, str]:
+    # Resolves the env defaults; returns (typed, partition folder, elt_date value)
+    if typed is None:
+        typed = PARQUET_TYPED_COLUMNS
+    if partitioning is None:
+        partitioning = PARQUET_PARTITIONING
+    if partitioning not in ("date", "hive"):
+        raise ValueError(f"partitioning must be 'date' or 'hive', got {partitioning!r}")
+    now = datetime.now(timezone.utc)
+    elt_date_str = now.date().isoformat()  # e.g., '2025-10-10' (UTC)
+    partition = f"elt_date={elt_date_str}" if partitioning == "hive" else f"{now:%Y/%m/%d}"
+    return typed, partition, elt_date_str
+
+def _table_kind(table: pa.Table) -> str:
+    # "" for tables that didn't come out of _output_tables (e.g. converted DataFrames)
+    return (table.schema.metadata or {}).get(_TABLE_KIND_KEY, b"").decode()
+
+def _folder(name: str, table: pa.Table) -> str:
+    return _table_kind(table) or name.rsplit("_", 1)[0]
+
+def _file_table(table: pa.Table, typed: bool, elt_date_str: str) -> pa.Table:
+    # Arrow tables are immutable: the string columns go into a new table, no defensive copy
+    names = [n for n in table.column_names if n != "elt_date"]
+    columns = [table.column(n) if typed else _as_text(table.column(n)) for n in names]
+    out = pa.table(
+        columns + [pa.repeat(pa.scalar(elt_date_str), table.num_rows)],
+        names=names + ["elt_date"],
+    )
+
+    schema = FILE_SCHEMAS.get(_table_kind(table))
+    if schema is not None and out.column_names == schema.names:
+        # Same physical schema on every run, whatever pandas inferred for this batch
+        if not typed:
+            schema = pa.schema([pa.field(f.name, pa.string()) for f in schema])
+        # Unsafe only for the timestamps (ns -> us truncation); every other column keeps
+        # the overflow/truncation checks
+        out = pa.table(
+            [out.column(f.name).cast(f.type, safe=not pa.types.is_timestamp(f.type)) for f in schema],
+            schema=schema,
+        )
+    return out
+
+def _writer_options(schema: pa.Schema) -> Dict[str, Any]:
+    # Arrow's C++ writer directly, with explicit codec/dictionary settings instead
+    # of to_parquet's engine-dependent defaults
+    return dict(
+        compression=PARQUET_COMPRESSION,
+        compression_level=ZSTD_LEVEL if PARQUET_COMPRESSION.lower() == "zstd" else None,
+        use_dictionary=[n for n in schema.names if n not in PLAIN_ENCODED_COLUMNS],
+        data_page_size=1 << 20,
+        write_statistics=True,
+    )
 
 def write_parquet_blob(
-    dfs: Dict[str, pd.DataFrame],
+    tables: Dict[str, pa.Table | pd.DataFrame],
     account_url: str,
     container: str,
     overwrite: bool = True,
     app_prefix = "msteams",
+    typed: bool | None = None,  # None -> PARQUET_TYPED_COLUMNS env flag
+    partitioning: str | None = None,  # None -> PARQUET_PARTITIONING env setting
 ) -> Dict[str, str]:
     """
-    Writes Parquet files to Azure Blob at <container>/<prefix>/<name>.parquet.
-    Adds an 'elt_date' column (YYYY-MM-DD) to each dataset with today's UTC date.
+    Writes Parquet files to Azure Blob at <container>/<prefix>/parquet/<table>/<partition>/<name>.parquet,
+    where <partition> is YYYY/MM/DD or, with partitioning="hive", elt_date=YYYY-MM-DD.
+    Accepts Arrow tables (DataFrames are converted). Columns are written as strings
+    unless typed, plus an 'elt_date' column (YYYY-MM-DD) with today's UTC date.
     Returns dict of blob URLs.
     """
-    now = datetime.now(timezone.utc)
-    elt_date_str = now.date().isoformat()  # e.g., '2025-10-10' (UTC)
+    typed, partition, elt_date_str = _write_settings(typed, partitioning)
 
-    cred = DefaultAzureCredential()
-    svc  = BlobServiceClient(account_url=account_url, credential=cred)
-    cc   = svc.get_container_client(container)
-    try:
-        cc.create_container()
-    except Exception:
-        pass
+    ensure_container(account_url, container)
+    cc = get_service_client(account_url).get_container_client(container)
 
-    outputs = {}
-    for name, df in dfs.items():
-        if df.empty:
-            continue
+    def _write_one(name: str, table: pa.Table) -> str:
+        out = _file_table(table, typed, elt_date_str)
+        blob_name = f"{app_prefix}/parquet/{_folder(name, table)}/{partition}/{name}.parquet"
+        bc = cc.get_blob_client(blob_name)
 
-        # Ensure we don't mutate the caller's DataFrame
-        df_out = df.copy()
+        # Written straight into the blob: blocks are staged while later row groups
+        # are still being encoded.
+        with BlockBlobWriter(bc, overwrite=overwrite, content_settings=_PARQUET_CONTENT) as sink:
+            pq.write_table(out, sink, row_group_size=PARQUET_ROW_GROUP, **_writer_options(out.schema))
+        return f"{account_url.rstrip('/')}/{container}/{blob_name}"
 
-        # Add/overwrite elt_date with today's date (as a string). If you prefer a date-like timestamp,
-        # you can use: pd.to_datetime(now.date()) instead.
-        df_out["elt_date"] = elt_date_str
-        df_out = df_out.astype("string")
+    # Tables are encoded and uploaded concurrently over the shared connection pool,
+    # so the wall time is the slowest file rather than the sum of all of them.
+    todo = []
+    for name, table in tables.items():
+        if isinstance(table, pd.DataFrame):
+            table = pa.Table.from_pandas(table, preserve_index=False)
+        if table.num_rows:
+            todo.append((name, table))
+    if not todo:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(todo)) as ex:
+        urls = list(ex.map(lambda item: _write_one(*item), todo))
+    return {name: url for (name, _), url in zip(todo, urls)}
 
-        buf = io.BytesIO()
-        df_out.to_parquet(buf, index=False)
-        buf.seek(0)
+def write_docs_parquet_blob(
+    docs: Iterable[Dict[str, Any]],
+    user_name,
+    account_url: str,
+    container: str,
+    overwrite: bool = True,
+    app_prefix = "msteams",
+    typed: bool | None = None,
+    partitioning: str | None = None,
+    batch_docs: int = DOCS_PER_BATCH,
+) -> Dict[str, str]:
+    """
+    Streaming form of json_docs_to_tables + write_parquet_blob, for exports too big to
+    flatten in one go. docs is consumed once, batch_docs at a time; each batch is
+    flattened and appended to the three open Parquet files as its own row group(s), so
+    memory is bounded by one batch plus the blocks in flight. Same blobs and contents
+    as the two-step path; only the row-group boundaries differ. Nothing is committed
+    if any batch fails. Returns dict of blob URLs.
+    """
+    typed, partition, elt_date_str = _write_settings(typed, partitioning)
 
-        folder = name.rsplit("_", 1)[0]
-        blob_name = f"{app_prefix}/parquet/{folder}/{now:%Y/%m/%d}/{name}.parquet"
-        bc = cc.get_blob_client(blob_name)
-        bc.upload_blob(
-            buf.getvalue(),
-            overwrite=overwrite,
-            content_settings=ContentSettings(content_type="application/octet-stream"),
-        )
-        outputs[name] = f"{account_url.rstrip('/')}/{container}/{blob_name}"
+    ensure_container(account_url, container)
+    cc = get_service_client(account_url).get_container_client(container)
 
-    return outputs
+    # One BlockBlobWriter + ParquetWriter per output file, opened on its first rows.
+    # Every batch is cast to the fixed file schema, so the writers accept all of them.
+    writers: Dict[str, Tuple[BlockBlobWriter, pq.ParquetWriter]] = {}
+    urls: Dict[str, str] = {}
+    it = iter(docs)
+    try:
+        while batch := list(islice(it, batch_docs)):
+            for name, table in json_docs_to_tables(batch, user_name).items():
+                if not table.num_rows:
+                    continue
+                out = _file_table(table, typed, elt_date_str)
+                if name not in writers:
+                    blob_name = f"{app_prefix}/parquet/{_folder(name, table)}/{partition}/{name}.parquet"
+                    sink = BlockBlobWriter(
+                        cc.get_blob_client(blob_name), overwrite=overwrite, content_settings=_PARQUET_CONTENT,
+                    )
+                    writers[name] = (sink, pq.ParquetWriter(sink, out.schema, **_writer_options(out.schema)))
+                    urls[name] = f"{account_url.rstrip('/')}/{container}/{blob_name}"
+                writers[name][1].write_table(out, row_group_size=PARQUET_ROW_GROUP)
+        for sink, writer in writers.values():
+            writer.close()  # footer
+            sink.close()    # commit
+    except BaseException:
+        for sink, writer in writers.values():
+            sink.abort()
+            try:
+                writer.close()  # its footer write now fails on the aborted sink
+            except Exception:
+                pass
+        raise
+    return urls